@@ -1,30 +1,38 @@
 import logging
 import sqlite3
+import threading
 from datetime import datetime
 import time
-from contextlib import contextmanager
-from typing import Optional, List, Dict, Any, Union, Tuple
+from contextlib import contextmanager, nullcontext
+from typing import Optional, List, Dict, Any, Union, Tuple, Iterator
 
 DB_FILE = "gameservers.db"
 
-@contextmanager
-def get_db_connection(max_attempts=5, timeout=60.0):
-    conn = None
+DB_STATEMENT_CACHE_SIZE = 512
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+def create_connection(max_attempts=5, timeout=60.0) -> sqlite3.Connection:
     attempt = 0
     backoff_time = 1.0
     
     while attempt < max_attempts:
+        conn = None
         try:
-            conn = sqlite3.connect(DB_FILE, timeout=timeout)
+            conn = sqlite3.connect(DB_FILE, timeout=timeout, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE_SIZE)
             conn.row_factory = sqlite3.Row
             conn.execute("PRAGMA foreign_keys = ON")
             conn.execute("PRAGMA journal_mode = WAL")
-            conn.execute("PRAGMA cache_size = 10000")
+            conn.execute("PRAGMA cache_size = -65536")
             conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute("PRAGMA mmap_size = 268435456")
             conn.execute("PRAGMA busy_timeout = 60000")
-            yield conn
-            return
+            return conn
         except sqlite3.OperationalError as e:
+            if conn:
+                conn.close()
             if "database is locked" in str(e):
                 attempt += 1
                 logging.warning(f"Database locked, retrying... (attempt {attempt}/{max_attempts})")
@@ -32,13 +40,32 @@ def get_db_connection(max_attempts=5, timeout=60.0):
                 backoff_time *= 1.5
             else:
                 raise
-        finally:
-            if conn:
-                conn.close()
     
     logging.error("Could not connect to database after multiple attempts")
     raise sqlite3.OperationalError("Database is locked and could not be accessed after multiple attempts")
 
+@contextmanager
+def get_db_connection(max_attempts=5, timeout=60.0):
+    # Calls made inside transaction() on this thread share its connection
+    conn = getattr(_local, 'transaction_conn', None)
+    if conn is not None:
+        yield conn
+        return
+    
+    # Each thread keeps one long-lived connection so its prepared statements stay cached
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = create_connection(max_attempts, timeout)
+    
+    _local.conn_depth = getattr(_local, 'conn_depth', 0) + 1
+    try:
+        yield conn
+    finally:
+        _local.conn_depth -= 1
+        # Never leave a half-finished transaction behind once the outermost caller is done
+        if not _local.conn_depth and conn.in_transaction:
+            conn.rollback()
+
 def execute_with_retry(cursor, query, params=(), max_attempts=5):
     attempt = 0
     backoff_time = 1.0
@@ -59,6 +86,62 @@ def execute_with_retry(cursor, query, params=(), max_attempts=5):
     logging.error(f"Failed to execute query after {max_attempts} attempts due to database locks")
     raise sqlite3.OperationalError(f"Database is locked and query could not be executed after {max_attempts} attempts")
 
+def in_transaction() -> bool:
+    return getattr(_local, 'transaction_conn', None) is not None
+
+def after_commit(callback) -> None:
+    # In-memory caches must only see rows that actually committed, so defer until the outermost commit
+    if in_transaction():
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
+@contextmanager
+def transaction(mode: str = "IMMEDIATE"):
+    conn = getattr(_local, 'transaction_conn', None)
+    
+    # Nested blocks become savepoints so a failure only undoes their own writes
+    if conn is not None:
+        _local.savepoint_depth += 1
+        savepoint = f"sp_{_local.savepoint_depth}"
+        pending_callbacks = len(_local.after_commit)
+        conn.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield conn
+            conn.execute(f"RELEASE {savepoint}")
+        except Exception:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+            del _local.after_commit[pending_callbacks:]
+            raise
+        finally:
+            _local.savepoint_depth -= 1
+        return
+    
+    # Writers queue on an in-process lock rather than spinning on SQLITE_BUSY; readers stay concurrent under WAL
+    with (_write_lock if mode != "DEFERRED" else nullcontext()), get_db_connection() as conn:
+        conn.execute(f"BEGIN {mode}")
+        _local.transaction_conn = conn
+        _local.savepoint_depth = 0
+        _local.after_commit = []
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _local.transaction_conn = None
+            callbacks, _local.after_commit = _local.after_commit, []
+    
+    for callback in callbacks:
+        callback()
+
+@contextmanager
+def read_transaction():
+    with transaction("DEFERRED") as conn:
+        yield conn.cursor()
+
 def query_one(query: str, params: Tuple = ()) -> Optional[Dict[str, Any]]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -71,11 +154,16 @@ def query_all(query: str, params: Tuple = ()) -> List[Dict[str, Any]]:
         execute_with_retry(cursor, query, params)
         return cursor.fetchall()
 
-def execute_query(query: str, params: Tuple = ()) -> Optional[int]:
+def iter_query(query: str, params: Tuple = ()) -> Iterator[sqlite3.Row]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         execute_with_retry(cursor, query, params)
-        conn.commit()
+        yield from cursor
+
+def execute_query(query: str, params: Tuple = ()) -> Optional[int]:
+    with (get_db_connection() if in_transaction() else transaction()) as conn:
+        cursor = conn.cursor()
+        execute_with_retry(cursor, query, params)
         return cursor.lastrowid
 
 def init_database():
@@ -441,6 +529,47 @@ def migrate_database():
             cursor.execute('ALTER TABLE game_sessions ADD COLUMN session_result TEXT')
             logging.info("Added session_result column to game_sessions table")
         
+        cursor.execute("PRAGMA table_info(server_status)")
+        columns = cursor.fetchall()
+        column_names = [col[1] for col in columns]
+        
+        if 'timestamp_ms' not in column_names:
+            cursor.execute('ALTER TABLE server_status ADD COLUMN timestamp_ms INTEGER')
+            # timestamp holds naive local times, so convert through 'utc' to get real epoch milliseconds
+            cursor.execute('''
+            UPDATE server_status
+            SET timestamp_ms = CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)
+            WHERE timestamp_ms IS NULL
+            ''')
+            logging.info("Added timestamp_ms column to server_status table")
+        
+        # Composite indices for the death/redeem reporting and team composition queries
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ptc_session_redeem_ts ON player_team_changes(session_id, is_redeem, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ptc_session_death_ts ON player_team_changes(session_id, is_death, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ptc_session_redeem_wave ON player_team_changes(session_id, is_redeem, wave_number, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ts_session_team_ts ON team_status(session_id, team_id, timestamp DESC)')
+        
+        # Hot-path lookups in get_active_session
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gs_server_active ON game_sessions(server_id, start_time DESC) WHERE is_active = 1')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ss_session_wave ON server_status(session_id, wave_number)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ss_session_occupied_ms ON server_status(session_id, timestamp_ms) WHERE player_count > 0')
+        
+        # One snapshot per session, wave and reason; older databases may already hold duplicates, keep the first of each
+        cursor.execute('''
+        CREATE TEMP TABLE duplicate_wave_ends AS
+        SELECT id FROM wave_end_records
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM wave_end_records
+            GROUP BY session_id, wave_number, reason
+        )
+        ''')
+        cursor.execute('DELETE FROM player_wave_scores WHERE wave_end_id IN (SELECT id FROM duplicate_wave_ends)')
+        cursor.execute('DELETE FROM wave_end_records WHERE id IN (SELECT id FROM duplicate_wave_ends)')
+        if cursor.rowcount > 0:
+            logging.info(f"Removed {cursor.rowcount} duplicate wave end records")
+        cursor.execute('DROP TABLE duplicate_wave_ends')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_wer_session_wave_reason ON wave_end_records(session_id, wave_number, reason)')
+        
         # Update any null end times for inactive sessions
         execute_with_retry(cursor, '''
         UPDATE game_sessions 
@@ -1,22 +1,10 @@
-import time
 import logging
-import threading
 from datetime import datetime
-from pathlib import Path
-import signal
 import sys
 import codecs
 import re
 
-from database import init_database, migrate_database
-from server_monitor import ServerMonitor
-
-DATA_DIR = Path("./data")
-LOG_DIR = Path("./logs")
-INTERVAL_SECONDS = 10
-
-DATA_DIR.mkdir(exist_ok=True)
-LOG_DIR.mkdir(exist_ok=True)
+from server_monitor import LOG_DIR, main
 
 # Reset logging to avoid duplicate entries
 for handler in logging.root.handlers[:]:
@@ -90,32 +78,5 @@ logging.root.setLevel(logging.INFO)
 logging.root.addHandler(file_handler)
 logging.root.addHandler(console_handler)
 
-def signal_handler(sig, frame):
-    """Handle termination signals"""
-    global monitor
-    logging.info("Shutdown signal received. Stopping monitor...")
-    monitor.stop()
-    sys.exit(0)
-
-def main():
-    global monitor
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    logging.info("Server Monitor starting...")
-    init_database()
-    migrate_database()
-    
-    monitor = ServerMonitor()
-    monitor_thread = monitor.start()
-    
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logging.info("Keyboard interrupt received. Shutting down...")
-        monitor.stop()
-        monitor_thread.join(timeout=5)
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,9 @@
 import logging
 from datetime import datetime
-from database import get_db_connection, execute_with_retry, query_one, query_all, execute_query
-from typing import Optional, Dict, Any, List, Union
+from database import get_db_connection, execute_with_retry, query_one, query_all, execute_query, transaction
+from typing import Optional, Dict, Any, List, Union, Tuple
+
+PlayerRow = Tuple[Optional[int], str, str, Optional[int], int, bool, str]
 
 def update_player_record(
     session_id: Optional[int], 
@@ -92,6 +94,136 @@ def update_player_record(
             
             logging.debug(f"Added new player {player_name} to session {session_id} with initial score {score}")
 
+def update_player_records_bulk(rows: List[PlayerRow]) -> None:
+    # Collapse duplicate (session_id, steam_id) rows, the last one seen wins
+    latest_rows = {}
+    for row in rows:
+        if row[0]:
+            latest_rows[(row[0], row[1])] = row
+    
+    if not latest_rows:
+        return
+    
+    with transaction() as conn:
+        cursor = conn.cursor()
+        
+        existing = {}
+        for session_id in {session_id for session_id, _ in latest_rows}:
+            execute_with_retry(
+                cursor,
+                '''
+                SELECT id, session_id, steam_id, team_id, current_score, highest_score, initial_score, first_seen
+                FROM player_records
+                WHERE session_id = ?
+                ''', 
+                (session_id,)
+            )
+            for player in cursor.fetchall():
+                existing[(player['session_id'], player['steam_id'])] = player
+        
+        new_players = []
+        player_updates = []
+        new_keys = set()
+        score_changes = 0
+        team_score_rows = []
+        history_rows = []
+        
+        for key, (session_id, steam_id, player_name, team_id, score, is_bot, timestamp) in latest_rows.items():
+            player = existing.get(key)
+            
+            if not player:
+                new_players.append((session_id, steam_id, player_name, team_id, score, score, score, timestamp, timestamp, is_bot))
+                new_keys.add(key)
+                continue
+            
+            player_id = player['id']
+            current_score = player['current_score']
+            previous_team_id = player['team_id']
+            
+            if previous_team_id != team_id and previous_team_id is not None and team_id is not None:
+                handle_team_change(session_id, player_id, player_name, previous_team_id, team_id, timestamp, current_score, player['initial_score'], player['first_seen'])
+            
+            # The stored name only follows along when the score moved
+            player_updates.append((score, score, timestamp, player_name if score != current_score else None, team_id, player_id))
+            
+            if score != current_score:
+                score_changes += 1
+                
+                if team_id is not None:
+                    team_score_rows.append((player_id, session_id, team_id, score, score, timestamp, timestamp))
+                
+                if abs(score - current_score) > 5:
+                    history_rows.append((player_id, timestamp, score))
+        
+        if player_updates:
+            cursor.executemany(
+                '''
+                UPDATE player_records 
+                SET current_score = ?, highest_score = MAX(highest_score, ?), last_seen = ?, 
+                    player_name = COALESCE(?, player_name), team_id = ?
+                WHERE id = ?
+                ''', 
+                player_updates
+            )
+        
+        if new_players:
+            cursor.executemany(
+                '''
+                INSERT INTO player_records 
+                (session_id, steam_id, player_name, team_id, current_score, initial_score, highest_score, first_seen, last_seen, is_bot)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', 
+                new_players
+            )
+            
+            for session_id in {session_id for session_id, _ in new_keys}:
+                execute_with_retry(cursor, 'SELECT id, steam_id FROM player_records WHERE session_id = ?', (session_id,))
+                for player in cursor.fetchall():
+                    if (session_id, player['steam_id']) not in new_keys:
+                        continue
+                    
+                    _, steam_id, _, team_id, score, _, timestamp = latest_rows[(session_id, player['steam_id'])]
+                    
+                    if team_id is not None:
+                        team_score_rows.append((player['id'], session_id, team_id, score, score, timestamp, timestamp))
+                    
+                    history_rows.append((player['id'], timestamp, score))
+        
+        if team_score_rows:
+            # UPDATE then INSERT-if-missing: an upsert would burn an AUTOINCREMENT id on every score change
+            cursor.executemany(
+                '''
+                UPDATE player_team_scores 
+                SET final_score = ?, last_updated = ?
+                WHERE player_id = ? AND session_id = ? AND team_id = ?
+                ''', 
+                [(final_score, last_updated, player_id, session_id, team_id)
+                 for player_id, session_id, team_id, _, final_score, _, last_updated in team_score_rows]
+            )
+            cursor.executemany(
+                '''
+                INSERT INTO player_team_scores 
+                (player_id, session_id, team_id, initial_score, final_score, first_seen, last_updated)
+                SELECT ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM player_team_scores 
+                    WHERE player_id = ? AND session_id = ? AND team_id = ?
+                )
+                ''', 
+                [row + row[:3] for row in team_score_rows]
+            )
+        
+        if history_rows:
+            cursor.executemany(
+                '''
+                INSERT INTO score_history (player_id, timestamp, score)
+                VALUES (?, ?, ?)
+                ''', 
+                history_rows
+            )
+    
+    logging.debug(f"Updated {len(latest_rows)} player records ({len(new_keys)} new, {score_changes} score changes)")
+
 def handle_team_change(
     session_id: int, 
     player_id: int, 
@@ -233,24 +365,6 @@ def update_player_playtimes(session_id: Optional[int], end_time: str) -> None:
     if not session_id:
         return
     
-    execute_query(
-        '''
-        CREATE TABLE IF NOT EXISTS player_team_scores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_id INTEGER NOT NULL,
-            session_id INTEGER NOT NULL,
-            team_id INTEGER NOT NULL,
-            initial_score INTEGER NOT NULL DEFAULT 0,
-            final_score INTEGER NOT NULL DEFAULT 0,
-            first_seen TEXT NOT NULL,
-            last_updated TEXT NOT NULL,
-            UNIQUE(player_id, session_id, team_id),
-            FOREIGN KEY (player_id) REFERENCES player_records (id),
-            FOREIGN KEY (session_id) REFERENCES game_sessions (id)
-        )
-        '''
-    )
-    
     # Get all players in the session
     players = query_all(
         '''
@@ -456,27 +570,13 @@ def update_death_statistics(session_id: Optional[int]) -> None:
     
     processed_count = 0
     
-    # Ensure death stats table exists
-    execute_query(
-        '''
-        CREATE TABLE IF NOT EXISTS player_death_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            steam_id TEXT NOT NULL,
-            player_name TEXT NOT NULL,
-            total_deaths INTEGER NOT NULL DEFAULT 0,
-            waves_survived INTEGER NOT NULL DEFAULT 0,
-            last_updated TEXT NOT NULL,
-            UNIQUE(steam_id)
-        )
-        '''
-    )
+    now = datetime.now().isoformat()
     
     # Process each death event
     for death in deaths:
         steam_id = death['steam_id']
         player_name = death['player_name']
         wave_number = death['wave_number'] or 0
-        now = datetime.now().isoformat()
         
         # Get existing death stats
         stats = query_one(
@@ -524,25 +624,12 @@ def update_death_statistics(session_id: Optional[int]) -> None:
     
     redeem_count = 0
     
-    # Ensure redeem stats table exists
-    execute_query(
-        '''
-        CREATE TABLE IF NOT EXISTS player_redeem_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            steam_id TEXT NOT NULL,
-            player_name TEXT NOT NULL,
-            total_redeems INTEGER NOT NULL DEFAULT 0,
-            last_updated TEXT NOT NULL,
-            UNIQUE(steam_id)
-        )
-        '''
-    )
+    now = datetime.now().isoformat()
     
     # Process each redeem event
     for redeem in redeems:
         steam_id = redeem['steam_id']
         player_name = redeem['player_name']
-        now = datetime.now().isoformat()
         
         # Get existing redeem stats
         stats = query_one(
@@ -1,23 +1,47 @@
 import logging
 from datetime import datetime, timedelta
-from database import query_one, query_all, execute_query
-from typing import Optional, Dict, Any, List, Union, Set
+from database import query_one, query_all, iter_query, execute_query, execute_with_retry, read_transaction
+from session_manager import TEAM_NAMES
+from typing import Optional, Dict, Any, List, Union, Set, Iterator
+
+RECENT_REDEEMS_SQL = '''
+SELECT ptc.id, pr.player_name, ptc.wave_number, ptc.wave_text, s.name, gs.map_name
+FROM game_sessions gs
+JOIN player_team_changes ptc ON ptc.session_id = gs.id
+JOIN player_records pr ON ptc.player_id = pr.id
+LEFT JOIN servers s ON s.id = gs.server_id
+WHERE gs.is_active = 1 AND ptc.is_redeem = 1 AND ptc.timestamp > ?
+ORDER BY gs.id, ptc.timestamp DESC
+'''
+
+RECENT_DEATHS_SQL = '''
+SELECT ptc.id, pr.player_name, ptc.wave_number, ptc.wave_text, s.name, gs.map_name
+FROM game_sessions gs
+JOIN player_team_changes ptc ON ptc.session_id = gs.id
+JOIN player_records pr ON ptc.player_id = pr.id
+LEFT JOIN servers s ON s.id = gs.server_id
+WHERE gs.is_active = 1 AND gs.team1_player_count > 0 AND ptc.is_death = 1 AND ptc.timestamp > ?
+ORDER BY gs.id, ptc.timestamp DESC
+'''
+
+TOP_REDEEMERS_SQL = '''
+SELECT steam_id, player_name, total_redeems, last_updated
+FROM player_redeem_stats
+ORDER BY total_redeems DESC
+LIMIT ? OFFSET ?
+'''
 
 _reported_death_ids = set()
 _reported_redeem_ids = set()
 
-try:
-    from main import death_logger_instance as death_logger
-    from main import redeem_logger_instance as redeem_logger
-except ImportError:
-    death_logger = logging.getLogger('death_events')
-    redeem_logger = logging.getLogger('redeem_events')
-    if not death_logger.handlers:
-        death_logger = logging.getLogger()
-    if not redeem_logger.handlers:
-        redeem_logger = logging.getLogger()
+death_logger = logging.getLogger('death_events')
+redeem_logger = logging.getLogger('redeem_events')
+if not death_logger.handlers:
+    death_logger = logging.getLogger()
+if not redeem_logger.handlers:
+    redeem_logger = logging.getLogger()
 
-def get_player_redemption_stats(steam_id: Optional[str] = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+def get_player_redemption_stats(steam_id: Optional[str] = None, limit: int = 100, offset: int = 0) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
     if steam_id:
         return query_one(
             '''
@@ -40,8 +64,9 @@ def get_player_redemption_stats(steam_id: Optional[str] = None) -> Union[Dict[st
             '''
             SELECT * FROM player_redeem_stats
             ORDER BY total_redeems DESC
-            LIMIT 100
-            '''
+            LIMIT ? OFFSET ?
+            ''', 
+            (limit, offset)
         )
 
 def get_session_redeems(session_id: int, wave_number: Optional[int] = None) -> List[Dict[str, Any]]:
@@ -112,171 +137,117 @@ def get_session_team_composition(session_id: int, wave_number: Optional[int] = N
                 
                 return composition
     
+    return get_session_team_compositions([session_id]).get(session_id)
+
+def get_session_team_compositions(session_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    if not session_ids:
+        return {}
+    
+    placeholders = ", ".join("?" for _ in session_ids)
     results = query_all(
-        '''
-        SELECT ts.team_id, ts.team_name, ts.player_count, ts.total_score
-        FROM team_status ts
-        JOIN (
-            SELECT team_id, MAX(timestamp) as latest_time
+        f'''
+        SELECT latest.session_id, latest.team_id, latest.team_name, latest.player_count, latest.total_score,
+               gs.id as game_session_id, gs.wave_number, gs.wave_text
+        FROM (
+            SELECT session_id, team_id, team_name, player_count, total_score,
+                   ROW_NUMBER() OVER (PARTITION BY session_id, team_id ORDER BY timestamp DESC) as rn
             FROM team_status
-            WHERE session_id = ?
-            GROUP BY team_id
-        ) latest ON ts.team_id = latest.team_id AND ts.timestamp = latest.latest_time
-        WHERE ts.session_id = ?
+            WHERE session_id IN ({placeholders})
+        ) latest
+        LEFT JOIN game_sessions gs ON gs.id = latest.session_id
+        WHERE latest.rn = 1
         ''', 
-        (session_id, session_id)
+        tuple(session_ids)
     )
     
-    if results:
-        composition = {
-            'teams': {}
-        }
-        
-        session_data = query_one(
-            '''
-            SELECT wave_number, wave_text FROM game_sessions
-            WHERE id = ?
-            ''', 
-            (session_id,)
-        )
-        
-        if session_data:
-            composition['wave_number'] = session_data['wave_number']
-            composition['wave_text'] = session_data['wave_text']
+    compositions = {}
+    
+    for result in results:
+        session_id = result['session_id']
+        composition = compositions.get(session_id)
         
-        for result in results:
-            team_id = result['team_id']
-            composition['teams'][team_id] = {
-                'name': result['team_name'],
-                'player_count': result['player_count'],
-                'total_score': result['total_score']
+        if composition is None:
+            composition = compositions[session_id] = {
+                'teams': {}
             }
+            
+            if result['game_session_id'] is not None:
+                composition['wave_number'] = result['wave_number']
+                composition['wave_text'] = result['wave_text']
         
-        return composition
+        composition['teams'][result['team_id']] = {
+            'name': result['team_name'],
+            'player_count': result['player_count'],
+            'total_score': result['total_score']
+        }
     
-    return None
+    return compositions
 
 def get_team_name(team_id: int) -> str:
-    team_names = {
-        1: "Team 1",
-        2: "Team 2",
-        3: "Undead",
-        4: "Humans",
-        1002: "Spectators"
-    }
-    return team_names.get(team_id, f"Team {team_id}")
+    return TEAM_NAMES.get(team_id, f"Team {team_id}")
+
+def report_recent_activity(one_minute_ago: Optional[str] = None) -> None:
+    if one_minute_ago is None:
+        one_minute_ago = (datetime.now() - timedelta(minutes=1)).isoformat()
+    
+    with read_transaction() as cursor:
+        cursor.row_factory = None
+        _report_recent_deaths(cursor, one_minute_ago)
+        _report_recent_redeems(cursor, one_minute_ago)
 
 def report_recent_redeems() -> None:
+    with read_transaction() as cursor:
+        cursor.row_factory = None
+        _report_recent_redeems(cursor, (datetime.now() - timedelta(minutes=1)).isoformat())
+
+def _report_recent_redeems(cursor, one_minute_ago: str) -> None:
     global _reported_redeem_ids
     
-    active_sessions = query_all(
-        '''
-        SELECT id, server_id, map_name, wave_number, wave_text
-        FROM game_sessions
-        WHERE is_active = 1
-        '''
-    )
-    
-    if not active_sessions:
-        return
-    
-    one_minute_ago = (datetime.now() - timedelta(minutes=1)).isoformat()
+    recent_redeems = execute_with_retry(cursor, RECENT_REDEEMS_SQL, (one_minute_ago,)).fetchall()
     
-    for session in active_sessions:
-        session_id = session['id']
+    for redeem_id, player_name, wave_number, wave_text, server_name, map_name in recent_redeems:
+        if redeem_id in _reported_redeem_ids:
+            continue
         
-        recent_redeems = query_all(
-            '''
-            SELECT ptc.id, pr.player_name, ptc.timestamp, ptc.wave_number, ptc.wave_text
-            FROM player_team_changes ptc
-            JOIN player_records pr ON ptc.player_id = pr.id
-            WHERE ptc.session_id = ? AND ptc.is_redeem = 1 AND ptc.timestamp > ?
-            ORDER BY ptc.timestamp DESC
-            ''', 
-            (session_id, one_minute_ago)
-        )
+        _reported_redeem_ids.add(redeem_id)
         
-        if recent_redeems:
-            for redeem in recent_redeems:
-                redeem_id = redeem['id']
-                
-                if redeem_id in _reported_redeem_ids:
-                    continue
-                
-                _reported_redeem_ids.add(redeem_id)
-                
-                player_name = redeem['player_name']
-                wave_number = redeem['wave_number'] or 0
-                wave_text = redeem['wave_text'] or "Unknown Wave"
-                
-                server_name = get_server_name(session['server_id'])
-                
-                redeem_logger.info(f"REDEEM: {player_name} redeemed on {server_name} / {session['map_name']} at {wave_text} (Wave {wave_number})")
+        wave_number = wave_number or 0
+        wave_text = wave_text or "Unknown Wave"
+        server_name = server_name or "Unknown Server"
+        
+        redeem_logger.info(f"REDEEM: {player_name} redeemed on {server_name} / {map_name} at {wave_text} (Wave {wave_number})")
     
     if len(_reported_redeem_ids) > 1000:
         _reported_redeem_ids = set(list(_reported_redeem_ids)[-1000:])
 
-def get_server_name(server_id: int) -> str:
-    server = query_one('SELECT name FROM servers WHERE id = ?', (server_id,))
-    return server['name'] if server else "Unknown Server"
-
 def report_recent_deaths() -> None:
+    with read_transaction() as cursor:
+        cursor.row_factory = None
+        _report_recent_deaths(cursor, (datetime.now() - timedelta(minutes=1)).isoformat())
+
+def _report_recent_deaths(cursor, one_minute_ago: str) -> None:
     global _reported_death_ids
     
-    active_sessions = query_all(
-        '''
-        SELECT id, server_id, map_name, wave_number, wave_text
-        FROM game_sessions
-        WHERE is_active = 1 AND team1_player_count > 0
-        '''
-    )
-    
-    if not active_sessions:
-        return
-    
-    one_minute_ago = (datetime.now() - timedelta(minutes=1)).isoformat()
+    recent_deaths = execute_with_retry(cursor, RECENT_DEATHS_SQL, (one_minute_ago,)).fetchall()
     
-    for session in active_sessions:
-        session_id = session['id']
+    for death_id, player_name, wave_number, wave_text, server_name, map_name in recent_deaths:
+        if death_id in _reported_death_ids:
+            continue
         
-        recent_deaths = query_all(
-            '''
-            SELECT ptc.id, pr.player_name, ptc.timestamp, ptc.wave_number, ptc.wave_text
-            FROM player_team_changes ptc
-            JOIN player_records pr ON ptc.player_id = pr.id
-            WHERE ptc.session_id = ? AND ptc.is_death = 1 AND ptc.timestamp > ?
-            ORDER BY ptc.timestamp DESC
-            ''', 
-            (session_id, one_minute_ago)
-        )
+        _reported_death_ids.add(death_id)
         
-        if recent_deaths:
-            server_name = get_server_name(session['server_id'])
-            
-            for death in recent_deaths:
-                death_id = death['id']
-                
-                if death_id in _reported_death_ids:
-                    continue
-                
-                _reported_death_ids.add(death_id)
-                
-                player_name = death['player_name']
-                wave_number = death['wave_number'] or 0
-                wave_text = death['wave_text'] or "Unknown Wave"
-                
-                death_logger.info(f"DEATH: {player_name} died on {server_name} / {session['map_name']} at {wave_text} (Wave {wave_number})")
+        wave_number = wave_number or 0
+        wave_text = wave_text or "Unknown Wave"
+        server_name = server_name or "Unknown Server"
+        
+        death_logger.info(f"DEATH: {player_name} died on {server_name} / {map_name} at {wave_text} (Wave {wave_number})")
     
     if len(_reported_death_ids) > 1000:
         _reported_death_ids = set(list(_reported_death_ids)[-1000:])
 
-def get_top_redeemers(limit: int = 10) -> List[Dict[str, Any]]:
-    return query_all(
-        '''
-        SELECT steam_id, player_name, total_redeems, last_updated
-        FROM player_redeem_stats
-        ORDER BY total_redeems DESC
-        LIMIT ?
-        ''', 
-        (limit,)
-    )
\ No newline at end of file
+def get_top_redeemers(limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+    return query_all(TOP_REDEEMERS_SQL, (limit, offset))
+
+def iter_top_redeemers(limit: int = 10, offset: int = 0) -> Iterator[Dict[str, Any]]:
+    # Holds a read snapshot open until exhausted, so consume it promptly
+    yield from iter_query(TOP_REDEEMERS_SQL, (limit, offset))
@@ -1,41 +1,66 @@
 import logging
+import time
 from datetime import datetime
-from database import get_db_connection, execute_with_retry, query_one, execute_query
-from typing import Optional, Dict, Any
+from database import transaction, execute_with_retry, query_one, execute_query, after_commit
+from typing import Optional, Dict, Any, Tuple
 
-def get_or_create_server(server_code: str, server_name: Optional[str] = None) -> Optional[int]:
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        now = datetime.now().isoformat()
-        
-        try:
-            execute_with_retry(cursor, 'SELECT id FROM servers WHERE server_code = ?', (server_code,))
-            server = cursor.fetchone()
+SERVER_NAME_CACHE_SECONDS = 300
+
+_server_name_cache: Dict[int, Tuple[str, float]] = {}
+
+def heartbeat_server(server_code: str, server_name: Optional[str] = None, is_active: Optional[bool] = None) -> Optional[int]:
+    now = datetime.now().isoformat()
+    
+    try:
+        with transaction() as conn:
+            cursor = conn.cursor()
+            # UPDATE first: an upsert would burn an AUTOINCREMENT id on every heartbeat
+            row = execute_with_retry(cursor, '''
+                UPDATE servers SET
+                    last_seen = ?,
+                    name = COALESCE(?, name),
+                    is_active = COALESCE(?, is_active)
+                WHERE server_code = ?
+                RETURNING id
+                ''',
+                (now, server_name, is_active, server_code)).fetchone()
             
-            if server:
-                server_id = server['id']
-                execute_with_retry(cursor, 'UPDATE servers SET last_seen = ?, name = COALESCE(?, name) WHERE id = ?',
-                            (now, server_name, server_id))
-            else:
-                execute_with_retry(cursor, 'INSERT INTO servers (server_code, name, last_seen) VALUES (?, ?, ?)',
-                            (server_code, server_name or server_code, now))
-                server_id = cursor.lastrowid
-                logging.info(f"Created new server record for {server_code}")
-                
-            conn.commit()
-            return server_id
+            if row is None:
+                row = execute_with_retry(cursor, '''
+                    INSERT INTO servers (server_code, name, last_seen, is_active)
+                    VALUES (?, ?, ?, COALESCE(?, 1))
+                    RETURNING id
+                    ''',
+                    (server_code, server_name or server_code, now, is_active)).fetchone()
             
-        except Exception as e:
-            conn.rollback()
-            logging.error(f"Database error managing server {server_code}: {str(e)}")
-            return None
+            server_id = row['id']
+    except Exception as e:
+        logging.error(f"Database error managing server {server_code}: {str(e)}")
+        return None
+    
+    if server_name:
+        entry = (server_name, time.monotonic() + SERVER_NAME_CACHE_SECONDS)
+        after_commit(lambda: _server_name_cache.__setitem__(server_id, entry))
+    
+    return server_id
+
+def get_or_create_server(server_code: str, server_name: Optional[str] = None) -> Optional[int]:
+    return heartbeat_server(server_code, server_name)
 
 def get_server_name(server_id: int) -> str:
+    cached = _server_name_cache.get(server_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
     server = query_one('SELECT name FROM servers WHERE id = ?', (server_id,))
-    return server['name'] if server else "Unknown Server"
+    if not server:
+        return "Unknown Server"
+    
+    _server_name_cache[server_id] = (server['name'], time.monotonic() + SERVER_NAME_CACHE_SECONDS)
+    return server['name']
 
 def update_server_status(server_id: int, is_active: bool) -> None:
     execute_query(
         'UPDATE servers SET is_active = ?, last_seen = ? WHERE id = ?',
         (is_active, datetime.now().isoformat(), server_id)
-    )
\ No newline at end of file
+    )
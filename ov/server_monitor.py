@@ -1,23 +1,28 @@
-import os
 import time
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import threading
-import queue
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 import signal
 import sys
-import codecs
 from functools import wraps
-from typing import Dict, List, Optional, Any, Tuple, Union, Callable
+from typing import Dict, List, Optional, Tuple, Callable, Iterator
 
-from database import init_database, migrate_database
-from server_manager import get_or_create_server
-from session_manager import get_active_session, update_player_playtimes, end_session
-from player_manager import update_player_record, update_death_statistics
-from status_manager import save_server_status, save_team_status
-from redemption_stats import report_recent_redeems, report_recent_deaths
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from database import init_database, migrate_database, transaction, after_commit
+from server_manager import heartbeat_server
+from session_manager import get_active_session, update_player_playtimes, end_session, invalidate_session_cache
+from player_manager import update_player_records_bulk, update_death_statistics, PlayerRow
+from status_manager import save_server_statuses, save_team_statuses, StatusRow, TeamStatusRow
+from redemption_stats import report_recent_activity
 from wave_manager import save_wave_end_snapshot
 
 API_URL = "https://csc.sunrust.org/public/servers"
@@ -31,10 +36,24 @@ LOG_RETENTION_DAYS = 7
 REQUEST_TIMEOUT = 15
 MAX_RETRIES = 3
 RETRY_DELAY = 2
+MAX_BACKOFF_SECONDS = 60
+IDLE_CYCLES_BEFORE_SLOWDOWN = 5
+MAX_IDLE_INTERVAL_SECONDS = 30
+
+HTTP_POOL_SIZE = 32
+DETAIL_FETCH_WORKERS = 16
+SERVER_HEARTBEAT_SECONDS = 60
+DETAILS_CACHE_SECONDS = 5
+IDLE_SERVER_REFRESH_SECONDS = 60
 
 DATA_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 
+HTTP_SESSION = requests.Session()
+# Every fetch worker plus the list poll can hold a connection at once, so never size the pool below that
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=max(HTTP_POOL_SIZE, DETAIL_FETCH_WORKERS + 1), max_retries=0))
+HTTP_SESSION.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+
 def retry_request(func: Callable) -> Callable:
     """Decorator for retrying HTTP requests"""
     @wraps(func)
@@ -52,27 +71,39 @@ def retry_request(func: Callable) -> Callable:
                     return None
     return wrapper
 
+def decode_json(response: requests.Response) -> Dict:
+    """Decode a JSON body, treating a malformed payload like any other failed request"""
+    try:
+        return json_loads(response.content)
+    except ValueError as e:
+        raise requests.RequestException(f"Invalid JSON from {response.url}: {str(e)}") from e
+
 class ServerMonitor:
     def __init__(self):
         self.stop_event = threading.Event()
         self.last_minute = None
         self.thread_pool = []
-        self.task_queue = queue.Queue()
-        self.active_servers_cache = {}
+        self.fetch_executor = ThreadPoolExecutor(max_workers=DETAIL_FETCH_WORKERS, thread_name_prefix="fetch")
+        self._server_id_cache: Dict[str, Tuple[int, str, float]] = {}
+        self._details_cache: Dict[str, Tuple[Tuple, Dict, float]] = {}
+        self._bot_id_cache: Dict[Tuple[str, int], str] = {}
+        self._idle_servers_seen: Dict[str, Tuple[Tuple, float]] = {}
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._last_servers_json: Optional[Dict] = None
         self.last_status_report = datetime.now()
+        self.consecutive_failures = 0
+        self.idle_cycles = 0
         self.setup_log_rotation()
         
     def setup_log_rotation(self) -> None:
         """Set up log rotation to remove old log files"""
-        today = datetime.now().date()
+        self._last_rotation_date = datetime.now().date()
+        cutoff = time.time() - LOG_RETENTION_DAYS * 86400
         for log_file in LOG_DIR.glob("server_monitor_*.log"):
             try:
-                filename = log_file.name
-                date_str = filename.replace("server_monitor_", "").replace(".log", "")
-                file_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                
-                if (today - file_date).days > LOG_RETENTION_DAYS:
-                    os.remove(log_file)
+                if log_file.stat().st_mtime < cutoff:
+                    log_file.unlink()
                     logging.debug(f"Deleted old log file: {log_file}")
             except Exception as e:
                 logging.error(f"Error during log rotation for file {log_file}: {str(e)}")
@@ -80,182 +111,297 @@ class ServerMonitor:
     @retry_request
     def fetch_server_list(self) -> Optional[Dict]:
         """Fetch the list of servers from the API"""
-        response = requests.get(API_URL, timeout=REQUEST_TIMEOUT)
+        headers = {}
+        if self._last_servers_json is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+        
+        response = HTTP_SESSION.get(API_URL, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            return self._last_servers_json
+        
         response.raise_for_status()
-        return response.json()
+        self._last_servers_json = decode_json(response)
+        self._etag = response.headers.get('ETag')
+        self._last_modified = response.headers.get('Last-Modified')
+        return self._last_servers_json
 
     @retry_request
     def fetch_server_details(self, server_code: str) -> Optional[Dict]:
         """Fetch details for a specific server"""
         url = f"{API_URL}/{server_code}"
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
+        response = HTTP_SESSION.get(url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return decode_json(response)
+
+    def fetch_all_details(self, servers: Dict[str, Dict]) -> Iterator[Tuple[str, Optional[Dict], bool]]:
+        """Fetch details for several servers concurrently, reusing recent details for unchanged servers and flagging which are fresh"""
+        now = time.time()
+        cached = []
+        futures = {}
+        
+        for server_code, server_data in servers.items():
+            key = (server_data.get('PlayerCount', 0), server_data.get('Map'), server_data.get('ExtraInfo'))
+            entry = self._details_cache.get(server_code)
+            if entry and entry[0] == key and now - entry[2] < DETAILS_CACHE_SECONDS:
+                cached.append((server_code, entry[1], False))
+            else:
+                futures[self.fetch_executor.submit(self.fetch_server_details, server_code)] = (server_code, key)
+        
+        def results() -> Iterator[Tuple[str, Optional[Dict], bool]]:
+            yield from cached
+            for future in as_completed(futures):
+                server_code, key = futures[future]
+                try:
+                    details = future.result()
+                except Exception as e:
+                    logging.error(f"Error fetching details for server {server_code}: {str(e)}")
+                    details = None
+                if details is not None:
+                    self._details_cache[server_code] = (key, details, time.time())
+                yield server_code, details, True
+        
+        return results()
 
-    def process_server(self, server_code: str, server_data: Dict, timestamp: str) -> Tuple[int, int]:
+    def get_server_id(self, server_code: str, server_name: str) -> Optional[int]:
+        """Resolve a server id, only writing a heartbeat on a cache miss, rename or expiry"""
+        now = time.monotonic()
+        cached = self._server_id_cache.get(server_code)
+        
+        if cached and cached[1] == server_name and now - cached[2] < SERVER_HEARTBEAT_SECONDS:
+            return cached[0]
+        
+        server_id = heartbeat_server(server_code, server_name, is_active=True)
+        if server_id is not None:
+            # A rolled-back insert hands its id to the next new server, so only cache ids that committed
+            entry = (server_id, server_name, now)
+            after_commit(lambda: self._server_id_cache.__setitem__(server_code, entry))
+        
+        return server_id
+
+    def process_server(self, server_code: str, server_data: Dict, details: Optional[Dict], timestamp: str, player_rows: List[PlayerRow], status_rows: List[StatusRow], team_rows: List[TeamStatusRow], now: Optional[datetime] = None, fresh_details: bool = True) -> Tuple[int, int]:
         """Process data for a single server"""
         try:
-            player_count = server_data.get('PlayerCount', 0)
-            current_wave = server_data.get('ExtraInfo')
-            map_name = server_data.get('Map', 'Unknown')
-            max_players = server_data.get('MaxPlayers', 0)
-            server_name = server_data.get('Name', server_code)
-            
-            server_id = get_or_create_server(server_code, server_name)
-            
-            team_data = None
-            
-            if player_count >= MIN_PLAYERS_FOR_SESSION:
-                details = self.fetch_server_details(server_code)
+            with transaction():
+                player_count = server_data.get('PlayerCount', 0)
+                current_wave = server_data.get('ExtraInfo')
+                map_name = server_data.get('Map', 'Unknown')
+                max_players = server_data.get('MaxPlayers', 0)
+                server_name = server_data.get('Name', server_code)
                 
-                if details and 'TeamList' in details and 'PlayerList' in details:
-                    team_counts = {}
-                    team_scores = {}
-                    
-                    for player in details['PlayerList']:
-                        team_id = player.get('Details', {}).get('Team')
-                        if team_id:
-                            if team_id not in team_counts:
-                                team_counts[team_id] = 0
-                                team_scores[team_id] = 0
-                            
-                            team_counts[team_id] += 1
-                            
-                            score = player.get('Details', {}).get('Frags', 0)
-                            team_scores[team_id] += score
-                    
-                    team_data = team_counts
-            
-            session_id = get_active_session(server_id, map_name, current_wave, player_count, max_players, team_data)
-            save_server_status(session_id, player_count, current_wave, timestamp)
-            
-            # If there are players, save detailed infos
-            if player_count >= MIN_PLAYERS_FOR_SESSION and details:
-                if 'TeamList' in details and 'PlayerList' in details:
-                    for team_id, count in team_counts.items():
-                        team_name = details.get('TeamList', {}).get(str(team_id), {}).get('Name', f'Team {team_id}')
-                        save_team_status(session_id, team_id, team_name, count, team_scores[team_id], timestamp)
+                server_id = self.get_server_id(server_code, server_name)
+                
+                team_data = None
+                
+                if player_count >= MIN_PLAYERS_FOR_SESSION:
+                    if details and 'TeamList' in details and 'PlayerList' in details:
+                        team_counts = defaultdict(int)
+                        team_scores = defaultdict(int)
+                        
+                        for player in details['PlayerList']:
+                            player_details = player.get('Details') or {}
+                            team_id = player_details.get('Team')
+                            if team_id:
+                                team_counts[team_id] += 1
+                                team_scores[team_id] += player_details.get('Frags', 0)
+                        
+                        team_data = team_counts
+                
+                session_id = get_active_session(server_id, map_name, current_wave, player_count, max_players, team_data, now)
+                server_team_rows = []
+                server_player_rows = []
                 
-                if 'PlayerList' in details:
-                    self.process_players(session_id, details['PlayerList'], timestamp)
+                # If there are players, save detailed infos; cached details would replay old frags under a new timestamp
+                if player_count >= MIN_PLAYERS_FOR_SESSION and details and fresh_details:
+                    if 'TeamList' in details and 'PlayerList' in details:
+                        team_list = details['TeamList'] or {}
+                        for team_id, count in team_counts.items():
+                            team_name = (team_list.get(str(team_id)) or {}).get('Name', f'Team {team_id}')
+                            server_team_rows.append((session_id, team_id, team_name, count, team_scores[team_id], timestamp))
                     
-            return (1 if player_count > 0 else 0), player_count
+                    if 'PlayerList' in details:
+                        server_player_rows = self.process_players(session_id, details['PlayerList'], timestamp)
+                
+                # Status rows are only queued once the session work above has succeeded, they are flushed with the cycle
+                status_rows.append((session_id, player_count, current_wave, timestamp, int(now.timestamp() * 1000) if now else None))
+                team_rows.extend(server_team_rows)
+                player_rows.extend(server_player_rows)
+                
+                return (1 if player_count > 0 else 0), player_count
         except Exception as e:
             logging.error(f"Error processing server {server_code}: {str(e)}")
             return 0, 0
 
-    def process_players(self, session_id: int, player_list: List[Dict], timestamp: str) -> None:
-        """Process player data for a session"""
+    def process_players(self, session_id: int, player_list: List[Dict], timestamp: str) -> List[PlayerRow]:
+        """Build player record rows for a session"""
+        rows = []
+        
         for player in player_list:
             try:
+                player_details = player.get('Details') or {}
+                team_id = player_details.get('Team')
                 is_bot = player.get('SteamID64') == "0"
                 
                 if is_bot:
-                    bot_name = player.get('Details', {}).get('BotInfo', {}).get('Name', 'Unknown Bot')
-                    bot_team = player.get('Details', {}).get('Team', 0)
+                    bot_name = (player_details.get('BotInfo') or {}).get('Name', 'Unknown Bot')
                     
-                    steam_id = f"bot_{bot_name}_{bot_team}"
+                    bot_key = (bot_name, player_details.get('Team', 0))
+                    steam_id = self._bot_id_cache.get(bot_key)
+                    if steam_id is None:
+                        steam_id = self._bot_id_cache[bot_key] = f"bot_{bot_name}_{bot_key[1]}"
                     player_name = bot_name
                 else:
                     steam_id = player.get('SteamID64', 'Unknown')
-                    player_name = player.get('SteamPlayerDetails', {}).get('Name', 'Unknown Player')
+                    player_name = (player.get('SteamPlayerDetails') or {}).get('Name', 'Unknown Player')
                 
-                team_id = player.get('Details', {}).get('Team')
-                score = player.get('Details', {}).get('Frags', 0) or 0
+                score = player_details.get('Frags', 0) or 0
                 
-                update_player_record(session_id, steam_id, player_name, team_id, score, is_bot, timestamp)
+                rows.append((session_id, steam_id, player_name, team_id, score, is_bot, timestamp))
             except Exception as e:
                 logging.error(f"Error processing player {player.get('SteamID64', 'unknown')}: {str(e)}")
+        
+        return rows
 
-    def process_servers(self) -> None:
-        """Process all servers data"""
-        timestamp = datetime.now().isoformat()
+    def process_servers(self, now: Optional[datetime] = None) -> bool:
+        """Process all servers data, returning False if the server list could not be fetched"""
+        now = now or datetime.now()
+        timestamp = now.isoformat()
         logging.debug("Starting server data collection cycle")
         
         servers = self.fetch_server_list()
+        if servers is None:
+            return False
         if not servers:
-            return
+            return True
         
+        active_servers_data = {}
+        idle_servers = []
+        idle_changed = False
+        cycle_time = time.time()
         for server_code, server_data in servers.items():
-            self.task_queue.put((self.process_server, (server_code, server_data, timestamp)))
+            if server_data.get('PlayerCount', 0) >= MIN_PLAYERS_FOR_SESSION:
+                active_servers_data[server_code] = server_data
+                self._idle_servers_seen.pop(server_code, None)
+                continue
+            
+            # An idle server that hasn't changed only needs an occasional pass to keep timeouts and heartbeats moving
+            idle_key = (server_data.get('PlayerCount', 0), server_data.get('Map'), server_data.get('ExtraInfo'))
+            last_seen = self._idle_servers_seen.get(server_code)
+            if not last_seen or last_seen[0] != idle_key:
+                idle_changed = True
+            elif cycle_time - last_seen[1] < IDLE_SERVER_REFRESH_SECONDS:
+                continue
+            
+            self._idle_servers_seen[server_code] = (idle_key, cycle_time)
+            idle_servers.append((server_code, server_data))
         
-        self.task_queue.join()
-        self.active_servers_cache = servers
+        # Poll slower while every server sits empty and unchanged, snap back on any activity
+        self.idle_cycles = 0 if active_servers_data or idle_changed else self.idle_cycles + 1
+        
+        # All network I/O finishes before the write transaction opens, so the database lock never waits on a fetch
+        fetched_details = list(self.fetch_all_details(active_servers_data))
+        player_rows = []
+        status_rows = []
+        team_rows = []
+        active_servers = total_players = 0
+        
+        # SQLite has a single writer, so the cycle's writes go out serially in one transaction
+        with transaction():
+            for server_code, server_data in idle_servers:
+                active, players = self.process_server(server_code, server_data, None, timestamp, player_rows, status_rows, team_rows, now)
+                active_servers += active
+                total_players += players
+            
+            for server_code, details, fresh_details in fetched_details:
+                active, players = self.process_server(server_code, servers[server_code], details, timestamp, player_rows, status_rows, team_rows, now, fresh_details)
+                active_servers += active
+                total_players += players
+            
+            try:
+                save_server_statuses(status_rows)
+                save_team_statuses(team_rows)
+            except Exception as e:
+                logging.error(f"Error saving server status: {str(e)}")
+            
+            try:
+                update_player_records_bulk(player_rows)
+            except Exception as e:
+                logging.error(f"Error saving player records: {str(e)}")
         
-        now = datetime.now()
         if not self.last_minute or self.last_minute != now.minute:
             self.last_minute = now.minute
             
-            active_servers = sum(1 for s in servers.values() if s.get('PlayerCount', 0) > 0)
-            total_players = sum(s.get('PlayerCount', 0) for s in servers.values())
-            
             if active_servers > 0:
                 logging.info(f"Active servers: {active_servers} with {total_players} players")
-
-    def worker(self) -> None:
-        """Worker thread function to process tasks from the queue"""
-        while not self.stop_event.is_set():
-            try:
-                func, args = self.task_queue.get(timeout=1)
-                func(*args)
-                self.task_queue.task_done()
-            except queue.Empty:
-                pass
-            except Exception as e:
-                logging.error(f"Error in worker thread: {str(e)}")
-                self.task_queue.task_done()
+        
+        return True
 
     def monitor_thread(self) -> None:
         """Main monitoring thread"""
         while not self.stop_event.is_set():
             try:
-                self.process_servers()
-                report_recent_deaths()
-                report_recent_redeems()
+                cycle_start = datetime.now()
+                if self.process_servers(cycle_start):
+                    self.consecutive_failures = 0
+                else:
+                    self.consecutive_failures += 1
+                report_recent_activity((cycle_start - timedelta(minutes=1)).isoformat())
+                
+                if cycle_start.date() != self._last_rotation_date:
+                    self.setup_log_rotation()
             except Exception as e:
+                # Only a failed server list fetch backs off polling, anything else is just logged
                 logging.error(f"Unexpected error in monitor thread: {str(e)}")
             
-            self.stop_event.wait(INTERVAL_SECONDS)
+            wait_time = INTERVAL_SECONDS
+            if self.consecutive_failures:
+                wait_time = min(INTERVAL_SECONDS * 2 ** min(self.consecutive_failures, 6), MAX_BACKOFF_SECONDS)
+                logging.warning(f"Server list unavailable ({self.consecutive_failures} consecutive failures), next poll in {wait_time}s")
+            elif self.idle_cycles >= IDLE_CYCLES_BEFORE_SLOWDOWN:
+                wait_time = min(INTERVAL_SECONDS * 2 ** (self.idle_cycles - IDLE_CYCLES_BEFORE_SLOWDOWN + 1), MAX_IDLE_INTERVAL_SECONDS)
+            
+            self.stop_event.wait(wait_time)
 
     def cleanup_previous_sessions(self) -> None:
         """Clean up any active sessions on startup"""
-        from database import query_all, execute_query
+        from database import query_all
         
         now = datetime.now().isoformat()
         
         active_sessions = query_all(
             '''
-            SELECT id, server_id, map_name, wave_number
+            SELECT id, wave_number
             FROM game_sessions
             WHERE is_active = 1
             '''
         )
         
-        processed_sessions = set()
+        invalidate_session_cache()
+        
+        if not active_sessions:
+            return
         
         for session in active_sessions:
-            session_id = session['id']
-            
-            if session_id in processed_sessions:
-                continue
-            
-            processed_sessions.add(session_id)
-            
-            wave_number = session['wave_number'] if session['wave_number'] is not None else 0
-            
-            logging.info(f"Found previously active session {session_id} on startup, marking as ended")
-            
-            execute_query(
+            logging.info(f"Found previously active session {session['id']} on startup, marking as ended")
+        
+        with transaction() as conn:
+            conn.executemany(
                 '''
                 UPDATE game_sessions
                 SET is_active = 0, end_time = ?, session_result = 'Incomplete - Server Restart'
                 WHERE id = ?
                 ''', 
-                (now, session_id)
+                [(now, session['id']) for session in active_sessions]
             )
+        
+        for session in active_sessions:
+            session_id = session['id']
+            wave_number = session['wave_number'] if session['wave_number'] is not None else 0
             
             try:
-                save_wave_end_snapshot(session_id, wave_number, "Server Restart")
+                save_wave_end_snapshot(session_id, wave_number, "Server Restart", now)
                 update_player_playtimes(session_id, now)
                 update_death_statistics(session_id)
             except Exception as e:
@@ -269,13 +415,6 @@ class ServerMonitor:
         
         self.cleanup_previous_sessions()
         
-        # Start worker threads
-        for _ in range(min(4, os.cpu_count() or 4)):
-            t = threading.Thread(target=self.worker)
-            t.daemon = True
-            t.start()
-            self.thread_pool.append(t)
-        
         monitor = threading.Thread(target=self.monitor_thread)
         monitor.daemon = True
         monitor.start()
@@ -291,6 +430,8 @@ class ServerMonitor:
         for thread in self.thread_pool:
             thread.join(timeout=5)
         
+        self.fetch_executor.shutdown(wait=False, cancel_futures=True)
+        
         logging.info("Server monitor stopped")
 
 monitor = None
@@ -1,7 +1,8 @@
 import logging
-from datetime import datetime, timedelta
-from database import get_db_connection, execute_with_retry, query_one, query_all, execute_query
-from utils import extract_wave_number
+import threading
+from datetime import datetime
+from database import get_db_connection, execute_with_retry, query_one, query_all, execute_query, transaction, after_commit
+from utils import extract_wave_number, ttl_cache
 from player_manager import update_player_playtimes, update_death_statistics
 from wave_manager import save_wave_end_snapshot
 from typing import Optional, Dict, Any, List, Union, Tuple
@@ -16,139 +17,164 @@ TEAM_NAMES = {
     1002: "Spectators"
 }
 
+# server_id -> last known active session, so a steady wave can skip the lookup query
+_SESSION_CACHE: Dict[int, Dict[str, Any]] = {}
+_session_cache_lock = threading.Lock()
+
+def invalidate_session_cache(server_id: Optional[int] = None, session_id: Optional[int] = None) -> None:
+    with _session_cache_lock:
+        if server_id is None and session_id is None:
+            _SESSION_CACHE.clear()
+        elif server_id is not None:
+            _SESSION_CACHE.pop(server_id, None)
+        else:
+            for cached_server_id, cached in list(_SESSION_CACHE.items()):
+                if cached['id'] == session_id:
+                    del _SESSION_CACHE[cached_server_id]
+
+def _cache_session(server_id: int, entry: Dict[str, Any]) -> None:
+    with _session_cache_lock:
+        _SESSION_CACHE[server_id] = entry
+
 def get_active_session(
     server_id: int, 
     map_name: str, 
     current_wave: Optional[str], 
     player_count: int, 
     max_players: int, 
-    team_data: Optional[Dict[int, int]] = None
+    team_data: Optional[Dict[int, int]] = None,
+    now_dt: Optional[datetime] = None
 ) -> Optional[int]:
-    now = datetime.now().isoformat()
     current_wave_number = extract_wave_number(current_wave)
     
-    active_server_session = query_one(
-        '''
-        SELECT id, map_name, wave_number, wave_text, peak_player_count, is_active, end_time
-        FROM game_sessions 
-        WHERE server_id = ? AND is_active = 1
-        ORDER BY start_time DESC LIMIT 1
-        ''', 
-        (server_id,)
-    )
+    # Same map and same wave as last tick: none of the branches below can fire
+    with _session_cache_lock:
+        cached = _SESSION_CACHE.get(server_id)
+        if cached and (cached['map_name'] != map_name or current_wave_number is None or cached['wave_number'] != current_wave_number):
+            del _SESSION_CACHE[server_id]
+            cached = None
     
-    if active_server_session and active_server_session['map_name'] != map_name:
-        old_session_id = active_server_session['id']
-        previous_wave_number = active_server_session['wave_number']
-        old_map_name = active_server_session['map_name']
-        
-        session_result = determine_session_result(old_session_id, previous_wave_number)
+    if cached:
+        update_session(cached['id'], current_wave, current_wave_number, player_count, team_data)
+        return cached['id']
+    
+    # One transaction for the whole decision, so a map change or restart ends the old session atomically
+    with transaction():
+        now_dt = now_dt or datetime.now()
+        now = now_dt.isoformat()
         
-        execute_query(
+        # Everything the branches below need comes back in one round-trip
+        active_server_session = query_one(
             '''
-            UPDATE game_sessions 
-            SET is_active = 0, end_time = ?, session_result = ?
-            WHERE id = ?
+            WITH active AS (
+                SELECT id, map_name, wave_number, wave_text, is_active, end_time, team1_player_count
+                FROM game_sessions 
+                WHERE server_id = ? AND is_active = 1
+                ORDER BY start_time DESC LIMIT 1
+            )
+            SELECT active.*,
+                   EXISTS (SELECT 1 FROM server_status
+                           WHERE session_id = active.id AND wave_number = ?) as seen_current_wave,
+                   (SELECT MAX(timestamp_ms) FROM server_status
+                    WHERE session_id = active.id AND player_count > 0) as last_active_ms
+            FROM active
             ''', 
-            (now, session_result + " - Map Changed", old_session_id)
+            (server_id, current_wave_number)
         )
         
-        save_wave_end_snapshot(old_session_id, previous_wave_number or 0, "Map Changed")
-        update_player_playtimes(old_session_id, now)
-        update_death_statistics(old_session_id)
-        
-        logging.info(f"MAP: Change detected for server_id {server_id}: {old_map_name} -> {map_name}")
-        
-        return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
-    
-    session = query_one(
-        '''
-        SELECT id, map_name, wave_number, wave_text, peak_player_count, is_active, end_time
-        FROM game_sessions 
-        WHERE server_id = ? AND map_name = ? AND is_active = 1
-        ORDER BY start_time DESC LIMIT 1
-        ''', 
-        (server_id, map_name)
-    )
-    
-    if not session:
-        return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
-    
-    session_id = session['id']
-    previous_wave_number = session['wave_number']
-    
-    if session['end_time'] and session['end_time'] != '[NULL]':
-        logging.info(f"Session {session_id} already has an end time set, creating new session")
-        return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
-    
-    if current_wave_number is not None and previous_wave_number is not None:
-        if current_wave_number < previous_wave_number:
-            same_wave_count = query_one(
+        if active_server_session and active_server_session['map_name'] != map_name:
+            old_session_id = active_server_session['id']
+            previous_wave_number = active_server_session['wave_number']
+            old_map_name = active_server_session['map_name']
+            
+            session_result = determine_session_result(active_server_session, previous_wave_number)
+            
+            execute_query(
                 '''
-                SELECT COUNT(*) as count FROM server_status
-                WHERE session_id = ? AND wave_number = ?
+                UPDATE game_sessions 
+                SET is_active = 0, end_time = ?, session_result = ?
+                WHERE id = ?
                 ''', 
-                (session_id, current_wave_number)
-            )['count']
+                (now, session_result + " - Map Changed", old_session_id)
+            )
             
-            if same_wave_count > 0 or current_wave_number == 1:
-                logging.info(f"WAVE: Round restart detected for server_id {server_id} on {map_name}: {previous_wave_number} -> {current_wave_number}")
-                
-                session_result = determine_session_result(session_id, previous_wave_number)
-                
-                execute_query(
-                    '''
-                    UPDATE game_sessions 
-                    SET is_active = 0, end_time = ?, session_result = ?
-                    WHERE id = ?
-                    ''', 
-                    (now, session_result + " - Round Restarted", session_id)
-                )
-                
-                save_wave_end_snapshot(session_id, previous_wave_number, "Round Restarted")
-                update_player_playtimes(session_id, now)
-                update_death_statistics(session_id)
-                
-                return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
-            else:
-                logging.info(f"WAVE: Reset without restart detected for session {session_id}: {previous_wave_number} -> {current_wave_number}")
-        elif current_wave_number > previous_wave_number:
-            if previous_wave_number > 0:
-                save_wave_end_snapshot(session_id, previous_wave_number, "Wave Completed")
+            save_wave_end_snapshot(old_session_id, previous_wave_number or 0, "Map Changed", now)
+            update_player_playtimes(old_session_id, now)
+            update_death_statistics(old_session_id)
             
-            logging.info(f"WAVE: Progression detected for session {session_id}: {previous_wave_number} -> {current_wave_number}")
-    else:
-        last_active = query_one(
-            '''
-            SELECT timestamp FROM server_status 
-            WHERE session_id = ? AND player_count > 0 
-            ORDER BY timestamp DESC LIMIT 1
-            ''', 
-            (session_id,)
-        )
-        
-        if last_active:
-            last_active_time = datetime.fromisoformat(last_active['timestamp'])
-            now_time = datetime.fromisoformat(now)
+            logging.info(f"MAP: Change detected for server_id {server_id}: {old_map_name} -> {map_name}")
             
-            if (now_time - last_active_time) > timedelta(minutes=SESSION_TIMEOUT_MINUTES):
-                logging.info(f"SERVER: ID {server_id} was inactive for over {SESSION_TIMEOUT_MINUTES} minutes")
-                
-                execute_query(
-                    '''
-                    UPDATE game_sessions 
-                    SET is_active = 0, end_time = ?, session_result = 'Loss - Timeout' 
-                    WHERE id = ?
-                    ''', 
-                    (now, session_id)
-                )
-                
-                save_wave_end_snapshot(session_id, previous_wave_number or 0, "Timeout")
+            return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
+        
+        # The newest active session is on this map, otherwise the branch above already replaced it
+        session = active_server_session
+        
+        if not session:
+            return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
+        
+        session_id = session['id']
+        previous_wave_number = session['wave_number']
+        
+        if session['end_time'] and session['end_time'] != '[NULL]':
+            logging.info(f"Session {session_id} already has an end time set, creating new session")
+            return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
+        
+        if current_wave_number is not None and previous_wave_number is not None:
+            if current_wave_number < previous_wave_number:
+                if session['seen_current_wave'] or current_wave_number == 1:
+                    logging.info(f"WAVE: Round restart detected for server_id {server_id} on {map_name}: {previous_wave_number} -> {current_wave_number}")
+                    
+                    session_result = determine_session_result(session, previous_wave_number)
+                    
+                    execute_query(
+                        '''
+                        UPDATE game_sessions 
+                        SET is_active = 0, end_time = ?, session_result = ?
+                        WHERE id = ?
+                        ''', 
+                        (now, session_result + " - Round Restarted", session_id)
+                    )
+                    
+                    save_wave_end_snapshot(session_id, previous_wave_number, "Round Restarted", now)
+                    update_player_playtimes(session_id, now)
+                    update_death_statistics(session_id)
+                    
+                    return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
+                else:
+                    logging.info(f"WAVE: Reset without restart detected for session {session_id}: {previous_wave_number} -> {current_wave_number}")
+            elif current_wave_number > previous_wave_number:
+                if previous_wave_number > 0:
+                    save_wave_end_snapshot(session_id, previous_wave_number, "Wave Completed", now)
                 
-                return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
-    
-    update_session(session_id, current_wave, current_wave_number, player_count, team_data)
-    return session_id
+                logging.info(f"WAVE: Progression detected for session {session_id}: {previous_wave_number} -> {current_wave_number}")
+        else:
+            last_active_ms = session['last_active_ms']
+            
+            if last_active_ms is not None:
+                if int(now_dt.timestamp() * 1000) - last_active_ms > SESSION_TIMEOUT_MINUTES * 60000:
+                    logging.info(f"SERVER: ID {server_id} was inactive for over {SESSION_TIMEOUT_MINUTES} minutes")
+                    
+                    execute_query(
+                        '''
+                        UPDATE game_sessions 
+                        SET is_active = 0, end_time = ?, session_result = 'Loss - Timeout' 
+                        WHERE id = ?
+                        ''', 
+                        (now, session_id)
+                    )
+                    
+                    save_wave_end_snapshot(session_id, previous_wave_number or 0, "Timeout", now)
+                    
+                    return create_new_session(server_id, map_name, current_wave, current_wave_number, player_count, max_players, team_data, now)
+        
+        update_session(session_id, current_wave, current_wave_number, player_count, team_data)
+        
+        if current_wave_number is not None:
+            # Published only once the caller's outermost transaction commits, a rollback must not leave the wave cached
+            entry = {'id': session_id, 'map_name': map_name, 'wave_number': current_wave_number}
+            after_commit(lambda: _cache_session(server_id, entry))
+        
+        return session_id
 
 def create_new_session(
     server_id: int, 
@@ -161,20 +187,12 @@ def create_new_session(
     now: str
 ) -> int:
 
+    invalidate_session_cache(server_id)
     team1_count = team2_count = 0
-    team_json_data = {}
     
     if team_data:
         team1_count = team_data.get(4, 0)  
         team2_count = team_data.get(3, 0)  
-        
-        for team_id, count in team_data.items():
-            team_name = TEAM_NAMES.get(team_id, f"Team {team_id}")
-            team_json_data[team_id] = {
-                "name": team_name,
-                "count": count
-            }
-    
     
     session_id = execute_query(
         '''
@@ -189,8 +207,8 @@ def create_new_session(
     
     logging.info(f"MAP: Created new game session {session_id} for server ID {server_id} on map {map_name}")
     
-    if team_data:
-        team_info = ", ".join([f"{TEAM_NAMES.get(team_id, f'Team {team_id}')}: {count}" for team_id, count in team_data.items()])
+    if team_data and logging.getLogger().isEnabledFor(logging.DEBUG):
+        team_info = ", ".join(f"{TEAM_NAMES.get(team_id) or f'Team {team_id}'}: {count}" for team_id, count in team_data.items())
         logging.debug(f"TEAMS: New session {session_id} teams - {team_info}")
     
     return session_id
@@ -202,9 +220,6 @@ def update_session(
     player_count: int, 
     team_data: Optional[Dict[int, int]]
 ) -> None:
-    session = query_one("SELECT peak_player_count FROM game_sessions WHERE id = ?", (session_id,))
-    peak_players = max(session['peak_player_count'], player_count)
-    
     if team_data:
         team1_count = team_data.get(4, 0)  # Humans
         team2_count = team_data.get(3, 0)  # Undead
@@ -215,34 +230,25 @@ def update_session(
         execute_query(
             '''
             UPDATE game_sessions 
-            SET wave_text = ?, wave_number = ?, peak_player_count = ?,
+            SET wave_text = ?, wave_number = ?, peak_player_count = MAX(peak_player_count, ?),
                 team1_player_count = ?, team2_player_count = ?
             WHERE id = ?
             ''', 
-            (current_wave, current_wave_number, peak_players, team1_count, team2_count, session_id)
+            (current_wave, current_wave_number, player_count, team1_count, team2_count, session_id)
         )
     else:
         execute_query(
             '''
             UPDATE game_sessions 
-            SET wave_text = ?, wave_number = ?, peak_player_count = ? 
+            SET wave_text = ?, wave_number = ?, peak_player_count = MAX(peak_player_count, ?) 
             WHERE id = ?
             ''', 
-            (current_wave, current_wave_number, peak_players, session_id)
+            (current_wave, current_wave_number, player_count, session_id)
         )
     
     logging.debug(f"Updated existing session {session_id}")
 
-def determine_session_result(session_id: int, wave_number: Optional[int]) -> str:
-    session_data = query_one(
-        '''
-        SELECT team1_player_count
-        FROM game_sessions
-        WHERE id = ?
-        ''', 
-        (session_id,)
-    )
-    
+def determine_session_result(session_data: Optional[Dict[str, Any]], wave_number: Optional[int]) -> str:
     if session_data:
         survivors = session_data['team1_player_count']
         
@@ -281,8 +287,8 @@ def get_active_sessions() -> List[Dict[str, Any]]:
         ORDER BY gs.start_time DESC
         ''')
 
-def end_session(session_id: int, result: str) -> None:
-    now = datetime.now().isoformat()
+def end_session(session_id: int, result: str, now: Optional[str] = None) -> None:
+    now = now or datetime.now().isoformat()
     session = query_one(
         '''
         SELECT wave_number 
@@ -295,6 +301,7 @@ def end_session(session_id: int, result: str) -> None:
     if not session:
         return
     
+    invalidate_session_cache(session_id=session_id)
     wave_number = session['wave_number'] or 0
     
     execute_query(
@@ -306,12 +313,14 @@ def end_session(session_id: int, result: str) -> None:
         (now, result, session_id)
     )
     
-    save_wave_end_snapshot(session_id, wave_number, f"Manual End: {result}")
+    save_wave_end_snapshot(session_id, wave_number, f"Manual End: {result}", now)
     update_player_playtimes(session_id, now)
     update_death_statistics(session_id)
+    after_commit(get_session_stats.cache_clear)
     
     logging.info(f"SERVER: Manually ended session {session_id} with result: {result}")
 
+@ttl_cache(seconds=2)
 def get_session_stats(session_id: int) -> Dict[str, Any]:
     session = query_one(
         '''
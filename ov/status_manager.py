@@ -1,34 +1,59 @@
 import logging
 from datetime import datetime
-from database import get_db_connection, execute_with_retry, query_one, execute_query
+from database import query_one, transaction
 from utils import extract_wave_number
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
-def save_server_status(session_id: Optional[int], player_count: int, wave: Optional[str], timestamp: str) -> None:
-    if not session_id:
-        return
-    
-    wave_number = extract_wave_number(wave)
-    
-    execute_query(
-        '''
-        INSERT INTO server_status (session_id, timestamp, player_count, wave_text, wave_number)
-        VALUES (?, ?, ?, ?, ?)
-        ''', 
-        (session_id, timestamp, player_count, wave, wave_number)
-    )
+# (session_id, player_count, wave_text, timestamp, timestamp_ms)
+StatusRow = Tuple[Optional[int], int, Optional[str], str, Optional[int]]
+# (session_id, team_id, team_name, player_count, total_score, timestamp)
+TeamStatusRow = Tuple[Optional[int], int, str, int, int, str]
+
+def save_server_status(session_id: Optional[int], player_count: int, wave: Optional[str], timestamp: str, timestamp_ms: Optional[int] = None) -> None:
+    save_server_statuses([(session_id, player_count, wave, timestamp, timestamp_ms)])
 
 def save_team_status(session_id: Optional[int], team_id: int, team_name: str, player_count: int, total_score: int, timestamp: str) -> None:
-    if not session_id:
+    save_team_statuses([(session_id, team_id, team_name, player_count, total_score, timestamp)])
+
+def save_server_statuses(rows: List[StatusRow]) -> None:
+    params = []
+    for session_id, player_count, wave, timestamp, timestamp_ms in rows:
+        if not session_id:
+            continue
+        if timestamp_ms is None:
+            timestamp_ms = int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+        params.append((session_id, timestamp, timestamp_ms, player_count, wave, extract_wave_number(wave)))
+    
+    if not params:
         return
     
-    execute_query(
-        '''
-        INSERT INTO team_status (session_id, timestamp, team_id, team_name, player_count, total_score)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', 
+    with transaction() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO server_status (session_id, timestamp, timestamp_ms, player_count, wave_text, wave_number)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', 
+            params
+        )
+
+def save_team_statuses(rows: List[TeamStatusRow]) -> None:
+    params = [
         (session_id, timestamp, team_id, team_name, player_count, total_score)
-    )
+        for session_id, team_id, team_name, player_count, total_score, timestamp in rows
+        if session_id
+    ]
+    
+    if not params:
+        return
+    
+    with transaction() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO team_status (session_id, timestamp, team_id, team_name, player_count, total_score)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', 
+            params
+        )
 
 def get_latest_server_status(session_id: int) -> Optional[Dict[str, Any]]:
     return query_one(
@@ -1,16 +1,40 @@
+import copy
 import re
+import time
+from functools import lru_cache, wraps
 from typing import Optional
 
+WAVE_PATTERN = re.compile(r'Wave\s*(\d+)', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r'\d+')
+
+@lru_cache(maxsize=4096)
 def extract_wave_number(wave_text: Optional[str]) -> Optional[int]:
     if not wave_text:
         return None
    
-    match = re.search(r'Wave\s*(\d+)', wave_text, re.IGNORECASE)
+    match = WAVE_PATTERN.search(wave_text)
     if match:
         return int(match.group(1))
    
-    numbers = re.findall(r'\d+', wave_text)
-    if numbers:
-        return int(numbers[0])
+    match = NUMBER_PATTERN.search(wave_text)
+    if match:
+        return int(match.group(0))
    
-    return None
\ No newline at end of file
+    return None
+
+def ttl_cache(seconds: float, maxsize: int = 256):
+    # Results are keyed by a time bucket, so an entry is reused for at most `seconds`
+    def decorator(func):
+        @lru_cache(maxsize=maxsize)
+        def cached(bucket, args, kwargs):
+            return func(*args, **dict(kwargs))
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            result = cached(int(time.monotonic() // seconds), args, tuple(sorted(kwargs.items())))
+            # Every caller in the window shares the entry, so hand out copies of mutable results
+            return copy.deepcopy(result) if isinstance(result, (dict, list)) else result
+        
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
@@ -1,49 +1,38 @@
 import logging
+from itertools import groupby
 from datetime import datetime
-from database import get_db_connection, execute_with_retry, query_one, query_all, execute_query
-from utils import extract_wave_number
+from database import get_db_connection, execute_with_retry, query_one, query_all, transaction
+from utils import ttl_cache
 from typing import Optional, Dict, Any, List, Union
 
-def save_wave_end_snapshot(session_id: int, wave_number: int, reason: str) -> Optional[int]:
-    timestamp = datetime.now().isoformat()
+def save_wave_end_snapshot(session_id: int, wave_number: int, reason: str, timestamp: Optional[str] = None) -> Optional[int]:
+    timestamp = timestamp or datetime.now().isoformat()
     
     try:
-        wave_end_id = execute_query(
-            '''
-            INSERT INTO wave_end_records (session_id, wave_number, timestamp, reason)
-            VALUES (?, ?, ?, ?)
-            ''', 
-            (session_id, wave_number, timestamp, reason)
-        )
-        
-        if not wave_end_id:
-            return None
-        
-        player_records = query_all(
-            '''
-            SELECT id, steam_id, player_name, team_id, current_score, is_bot
-            FROM player_records
-            WHERE session_id = ?
-            ''', 
-            (session_id,)
-        )
-        
-        for player in player_records:
-            execute_query(
-                '''
+        with transaction() as conn:
+            cursor = conn.cursor()
+            row = execute_with_retry(cursor, '''
+                INSERT OR IGNORE INTO wave_end_records (session_id, wave_number, timestamp, reason)
+                VALUES (?, ?, ?, ?)
+                RETURNING id
+                ''', 
+                (session_id, wave_number, timestamp, reason)
+            ).fetchone()
+            
+            # Already snapshotted for this session, wave and reason
+            if row is None:
+                return None
+            
+            wave_end_id = row['id']
+            
+            execute_with_retry(cursor, '''
                 INSERT INTO player_wave_scores 
                 (wave_end_id, player_id, steam_id, player_name, team_id, score, is_bot)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                SELECT ?, id, steam_id, player_name, team_id, current_score, is_bot
+                FROM player_records
+                WHERE session_id = ?
                 ''', 
-                (
-                    wave_end_id, 
-                    player['id'], 
-                    player['steam_id'], 
-                    player['player_name'], 
-                    player['team_id'], 
-                    player['current_score'], 
-                    player['is_bot']
-                )
+                (wave_end_id, session_id)
             )
         
         logging.info(f"Saved wave end snapshot for session {session_id}, wave {wave_number}, reason: {reason}")
@@ -142,37 +131,34 @@ def get_wave_summary(session_id: int, wave_number: int) -> Optional[Dict[str, An
     }
 
 def get_all_wave_summaries(session_id: int) -> List[Dict[str, Any]]:
-    wave_records = query_all(
+    rows = query_all(
         '''
-        SELECT id, wave_number, timestamp, reason
-        FROM wave_end_records
-        WHERE session_id = ?
-        ORDER BY wave_number
+        SELECT wer.id, wer.wave_number, wer.timestamp, wer.reason,
+               pws.team_id, COUNT(pws.id) as player_count, SUM(pws.score) as total_score
+        FROM wave_end_records wer
+        LEFT JOIN player_wave_scores pws ON pws.wave_end_id = wer.id
+        WHERE wer.session_id = ?
+        GROUP BY wer.id, pws.team_id
+        ORDER BY wer.wave_number, wer.id, pws.team_id
         ''', 
         (session_id,)
     )
     
     summaries = []
     
-    for record in wave_records:
-        wave_end_id = record['id']
-        wave_number = record['wave_number']
-        
-        team_stats = query_all(
-            '''
-            SELECT team_id, COUNT(*) as player_count, SUM(score) as total_score
-            FROM player_wave_scores
-            WHERE wave_end_id = ?
-            GROUP BY team_id
-            ''', 
-            (wave_end_id,)
-        )
+    for _, wave_rows in groupby(rows, key=lambda row: row['id']):
+        wave_rows = list(wave_rows)
+        record = wave_rows[0]
         
         summary = {
-            'wave_number': wave_number,
+            'wave_number': record['wave_number'],
             'timestamp': record['timestamp'],
             'reason': record['reason'],
-            'team_stats': team_stats
+            'team_stats': [
+                {'team_id': row['team_id'], 'player_count': row['player_count'], 'total_score': row['total_score']}
+                for row in wave_rows
+                if row['player_count']
+            ]
         }
         
         summaries.append(summary)
@@ -191,6 +177,7 @@ def get_player_wave_history(session_id: int, steam_id: str) -> List[Dict[str, An
         (session_id, steam_id)
     )
 
+@ttl_cache(seconds=2)
 def get_latest_wave(session_id: int) -> Optional[Dict[str, Any]]:
     return query_one(
         '''